@@ -0,0 +1,191 @@
+import argparse
+import csv
+import io
+import json
+import sys
+import uuid
+
+from admin_segments import SegmentedNDJSON
+from fhir_store import extract_medication, get_administration_med_id, get_subject_patient_id, request_rank
+
+
+med_admin_dir = "fhir_data/medication_administration"
+med_request_path = "fhir_data/medication_request/MedicationRequest.ndjson"
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "bundle": ("application/fhir+json", "json"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+ROW_FIELDS = [
+    "patient_id",
+    "administration_id",
+    "administered_at",
+    "administration_status",
+    "medication",
+    "rxnorm_code",
+    "request_id",
+    "request_status",
+    "dosage",
+    "prescriber",
+    "authored_on",
+]
+
+
+# Index MedicationRequests by (patient id, medication id). Prescriptions are few
+# compared to administrations, so only this side of the join is held in memory.
+def index_requests(requests):
+    index = {}
+    for request in requests:
+        if request.get("resourceType") != "MedicationRequest":
+            continue
+        med = extract_medication(request)
+        key = (get_subject_patient_id(request), med["RXnormCode"] or med["Medication"])
+        current = index.get(key)
+        if current is None or request_rank(request) > request_rank(current):
+            index[key] = request
+    return index
+
+
+# Yield (administration, matching MedicationRequest or None) pairs one at a time
+def iter_joined(request_index, administrations, patient_id=None):
+    for admin in administrations:
+        if admin.get("resourceType") != "MedicationAdministration":
+            continue
+        admin_patient_id = get_subject_patient_id(admin)
+        if patient_id and admin_patient_id != patient_id:
+            continue
+        yield admin, request_index.get((admin_patient_id, get_administration_med_id(admin)))
+
+
+def to_row(admin, request):
+    med = extract_medication(request) if request else {}
+    return {
+        "patient_id": get_subject_patient_id(admin),
+        "administration_id": admin.get("id", ""),
+        "administered_at": admin.get("effectiveDateTime", ""),
+        "administration_status": admin.get("status", ""),
+        "medication": admin.get("medicationCodeableConcept", {}).get("text") or med.get("Medication", ""),
+        "rxnorm_code": get_administration_med_id(admin),
+        "request_id": med.get("RequestID", ""),
+        "request_status": request.get("status", "") if request else "",
+        "dosage": med.get("Dosage", ""),
+        "prescriber": med.get("Prescriber", ""),
+        "authored_on": request.get("authoredOn", "") if request else "",
+    }
+
+
+def iter_csv_chunks(joined, chunk_size=1000):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=ROW_FIELDS)
+    writer.writeheader()
+    count = 0
+    for admin, request in joined:
+        writer.writerow(to_row(admin, request))
+        count += 1
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+# Bundle entry.fullUrl must be an absolute URI. Resource ids here are UUIDs; any
+# other id gets a stable name-based UUID derived from "Type/id".
+def full_url(resource):
+    resource_id = resource.get("id", "")
+    try:
+        return f"urn:uuid:{uuid.UUID(resource_id)}"
+    except ValueError:
+        name = f"{resource.get('resourceType')}/{resource_id}"
+        return f"urn:uuid:{uuid.uuid5(uuid.NAMESPACE_URL, name)}"
+
+
+# A FHIR collection Bundle written entry by entry. Each MedicationRequest is
+# included once, before the first administration that refers to it.
+def iter_bundle_chunks(joined, chunk_size=1000):
+    yield '{"resourceType": "Bundle", "type": "collection", "entry": ['
+    seen_requests = set()
+    parts = []
+    first = True
+    for admin, request in joined:
+        resources = [admin]
+        if request and request.get("id") not in seen_requests:
+            seen_requests.add(request.get("id"))
+            resources.insert(0, request)
+        for resource in resources:
+            entry = {"fullUrl": full_url(resource), "resource": resource}
+            parts.append(("" if first else ",") + json.dumps(entry))
+            first = False
+        if len(parts) >= chunk_size:
+            yield "".join(parts)
+            parts = []
+    parts.append("]}")
+    yield "".join(parts)
+
+
+def write_chunks(chunks, out):
+    for chunk in chunks:
+        out.write(chunk.encode("utf-8"))
+
+
+# Parquet is written one row group per chunk, so only chunk_size rows are in memory
+def write_parquet(joined, out, chunk_size=1000):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+
+    schema = pa.schema([(field, pa.string()) for field in ROW_FIELDS])
+    with pq.ParquetWriter(out, schema) as writer:
+        rows = []
+        for admin, request in joined:
+            rows.append(to_row(admin, request))
+            if len(rows) >= chunk_size:
+                writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+                rows = []
+        if rows:
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+
+
+# Stream the joined adherence history for one patient (or everyone) into a binary file
+def export_adherence(export_format, out, requests, segments, patient_id=None, start=None, end=None, chunk_size=1000):
+    joined = iter_joined(index_requests(requests), segments.read(start=start, end=end), patient_id)
+    if export_format == "csv":
+        write_chunks(iter_csv_chunks(joined, chunk_size), out)
+    elif export_format == "bundle":
+        write_chunks(iter_bundle_chunks(joined, chunk_size), out)
+    elif export_format == "parquet":
+        write_parquet(joined, out, chunk_size)
+    else:
+        raise ValueError(f"Unknown export format: {export_format}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export adherence history (MedicationRequest + MedicationAdministration)")
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+    parser.add_argument("--output", help="output file (default: stdout, not for parquet)")
+    parser.add_argument("--patient", help="only export this patient id")
+    parser.add_argument("--start", help="first date to include (YYYY-MM-DD)")
+    parser.add_argument("--end", help="last date to include (YYYY-MM-DD)")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.format == "parquet" and not args.output:
+        parser.error("--output is required for parquet")
+
+    with open(med_request_path, "r") as f:
+        requests = [json.loads(line) for line in f if line.strip()]
+    segments = SegmentedNDJSON(med_admin_dir)
+
+    if args.output:
+        with open(args.output, "wb") as out:
+            export_adherence(args.format, out, requests, segments, args.patient, args.start, args.end, args.chunk_size)
+    else:
+        export_adherence(args.format, sys.stdout.buffer, requests, segments, args.patient, args.start, args.end, args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
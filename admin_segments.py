@@ -0,0 +1,316 @@
+import argparse
+import gzip
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads in this process are serialized
+    fcntl = None
+
+
+MANIFEST_NAME = "manifest.json"
+LOCK_NAME = "manifest.lock"
+UNDATED = "undated"
+
+
+# Get the YYYY-MM-DD date of a record from one of its date fields
+def get_record_date(record, date_field="effectiveDateTime"):
+    value = record.get(date_field, "")
+    if not isinstance(value, str) or len(value) < 10:
+        return None
+    return value[:10]
+
+
+def _to_date_string(value):
+    if value is None:
+        return None
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()[:10]
+    return str(value)[:10]
+
+
+# Administrations written as monthly NDJSON segments (e.g. MedicationAdministration-2024-06.ndjson)
+# plus a manifest of each segment's date range, so date-bounded reads only open
+# the segments that can hold matching records. Cold segments are gzip-compressed;
+# a late record for a cold month goes to a new plain file next to the .gz, which
+# is appended to the .gz as another gzip member on the next rotation.
+class SegmentedNDJSON:
+    def __init__(self, directory, prefix="MedicationAdministration", date_field="effectiveDateTime"):
+        self.directory = directory
+        self.prefix = prefix
+        self.date_field = date_field
+        self.manifest_path = os.path.join(directory, MANIFEST_NAME)
+        self.lock_path = os.path.join(directory, LOCK_NAME)
+        self._lock = threading.Lock()
+
+    # Serialize manifest updates between threads and between processes (app
+    # servers, the CLI), so one writer cannot overwrite another's segment range
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def segment_name(self, record):
+        record_date = get_record_date(record, self.date_field)
+        key = record_date[:7] if record_date else UNDATED
+        return f"{self.prefix}-{key}.ndjson"
+
+    def _segment_key(self, name):
+        key = name[len(self.prefix) + 1:]
+        for suffix in (".gz", ".ndjson"):
+            if key.endswith(suffix):
+                key = key[:-len(suffix)]
+        return key
+
+    # Manifest: {"segments": {name: {"start", "end", "count", "compressed"}}}
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"segments": {}}
+
+    def _save_manifest(self, manifest):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def append(self, record):
+        self.append_many([record])
+
+    def append_many(self, records):
+        by_segment = {}
+        for record in records:
+            by_segment.setdefault(self.segment_name(record), []).append(record)
+        if not by_segment:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with self._locked():
+            manifest = self.load_manifest()
+            for name, group in by_segment.items():
+                entry = manifest["segments"].get(name)
+                with open(os.path.join(self.directory, name), "a") as f:
+                    for record in group:
+                        f.write(json.dumps(record) + "\n")
+                entry = entry or {"start": None, "end": None, "count": 0, "compressed": False}
+                for record in group:
+                    _extend_range(entry, get_record_date(record, self.date_field))
+                entry["count"] += len(group)
+                manifest["segments"][name] = entry
+            self._save_manifest(manifest)
+
+    # Names of the segments that may hold records between start and end (inclusive dates)
+    def segments_for(self, start=None, end=None):
+        start, end = _to_date_string(start), _to_date_string(end)
+        segments = dict(self.load_manifest()["segments"])
+
+        # Segments written without a manifest update still count, using their month as range
+        for file_name in self._segment_files():
+            name = file_name[:-3] if file_name.endswith(".gz") else file_name
+            if name not in segments:
+                segments[name] = self._month_range(name)
+
+        selected = []
+        for name, entry in sorted(segments.items()):
+            if self._segment_key(name) == UNDATED:
+                if start is None and end is None:
+                    selected.append(name)
+                continue
+            if start and entry.get("end") and entry["end"] < start:
+                continue
+            if end and entry.get("start") and entry["start"] > end:
+                continue
+            selected.append(name)
+        return selected
+
+    # Stream records between start and end (inclusive dates), oldest segment first
+    def read(self, start=None, end=None):
+        start, end = _to_date_string(start), _to_date_string(end)
+        for name in self.segments_for(start, end):
+            if not (start or end):
+                yield from self._read_segment(name)
+                continue
+            # Records are filed by month, so a month inside the range needs no per-line date check
+            month = self._month_range(name)
+            if (not start or month["start"] >= start) and (not end or month["end"] <= end):
+                yield from self._read_segment(name)
+                continue
+            # Months at the edges of the range: decode each line and check its date
+            for record in self._read_segment(name):
+                if _in_range(get_record_date(record, self.date_field), start, end):
+                    yield record
+
+    # Compressed part first, then records appended since the last rotation
+    def _read_segment(self, name):
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path + ".gz"):
+            yield from _read_lines(gzip.open(path + ".gz", "rb"))
+        if os.path.exists(path):
+            yield from _read_lines(open(path, "rb"))
+
+    def _segment_files(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return sorted(n for n in names if n.startswith(self.prefix + "-") and (n.endswith(".ndjson") or n.endswith(".ndjson.gz")))
+
+    def _month_range(self, name):
+        key = self._segment_key(name)
+        if key == UNDATED:
+            return {"start": None, "end": None}
+        year, month = int(key[:4]), int(key[5:7])
+        first = date(year, month, 1)
+        last = (first.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+        return {"start": first.isoformat(), "end": last.isoformat()}
+
+    # Compress every segment whose month ended more than cold_after_days ago.
+    # The current month always stays a plain file so it can be appended to and tailed.
+    def rotate(self, today=None, cold_after_days=31):
+        today = today or date.today()
+        cutoff = (today - timedelta(days=cold_after_days)).isoformat()
+        compressed = []
+        with self._locked():
+            manifest = self.load_manifest()
+            for name in self._segment_files():
+                if name.endswith(".gz"):
+                    continue
+                key = self._segment_key(name)
+                if key == UNDATED or self._month_range(name)["end"] >= cutoff:
+                    continue
+                self._compress(name)
+                if name not in manifest["segments"]:
+                    manifest["segments"][name] = self._scan_entry(name)
+                manifest["segments"][name]["compressed"] = True
+                compressed.append(name)
+            self._save_manifest(manifest)
+        return compressed
+
+    # Compress a plain segment. If the month already has a .gz, the plain file holds
+    # late records and is added as one more gzip member; the old members are copied
+    # as-is, never decompressed.
+    def _compress(self, name):
+        path = os.path.join(self.directory, name)
+        with open(path, "rb") as src, open(path + ".gz.tmp", "wb") as out:
+            if os.path.exists(path + ".gz"):
+                with open(path + ".gz", "rb") as old:
+                    shutil.copyfileobj(old, out, 1 << 20)
+            with gzip.GzipFile(fileobj=out, mode="wb") as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+        os.replace(path + ".gz.tmp", path + ".gz")
+        os.remove(path)
+
+    def _scan_entry(self, name):
+        entry = {"start": None, "end": None, "count": 0, "compressed": os.path.exists(os.path.join(self.directory, name + ".gz"))}
+        for record in self._read_segment(name):
+            _extend_range(entry, get_record_date(record, self.date_field))
+            entry["count"] += 1
+        return entry
+
+    # Rebuild the manifest by scanning every segment
+    def rebuild_manifest(self):
+        with self._locked():
+            manifest = {"segments": {}}
+            for file_name in self._segment_files():
+                name = file_name[:-3] if file_name.endswith(".gz") else file_name
+                if name not in manifest["segments"]:
+                    manifest["segments"][name] = self._scan_entry(name)
+            self._save_manifest(manifest)
+        return manifest
+
+    # Split an existing single-file NDJSON store into segments
+    def migrate(self, source_path, batch_size=10000):
+        batch, total = [], 0
+        with open(source_path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    batch.append(json.loads(line))
+                except ValueError:
+                    continue
+                if len(batch) >= batch_size:
+                    self.append_many(batch)
+                    total += len(batch)
+                    batch = []
+        self.append_many(batch)
+        return total + len(batch)
+
+
+def _read_lines(f):
+    with f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def _in_range(record_date, start, end):
+    if record_date is None:
+        return False
+    if start and record_date < start:
+        return False
+    if end and record_date > end:
+        return False
+    return True
+
+
+def _extend_range(entry, record_date):
+    if record_date is None:
+        return
+    if entry["start"] is None or record_date < entry["start"]:
+        entry["start"] = record_date
+    if entry["end"] is None or record_date > entry["end"]:
+        entry["end"] = record_date
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage time-partitioned MedicationAdministration segments")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate = commands.add_parser("migrate", help="split a single NDJSON file into monthly segments")
+    migrate.add_argument("source")
+    migrate.add_argument("directory")
+    migrate.add_argument("--remove-source", action="store_true", help="delete the source file after migrating")
+
+    rotate = commands.add_parser("rotate", help="compress cold segments")
+    rotate.add_argument("directory")
+    rotate.add_argument("--cold-after-days", type=int, default=31)
+
+    rebuild = commands.add_parser("rebuild-manifest", help="rescan segments and rewrite the manifest")
+    rebuild.add_argument("directory")
+
+    args = parser.parse_args()
+    if args.command == "migrate":
+        count = SegmentedNDJSON(args.directory).migrate(args.source)
+        print(f"Migrated {count} records into {args.directory}")
+        if args.remove_source:
+            os.remove(args.source)
+    elif args.command == "rotate":
+        for name in SegmentedNDJSON(args.directory).rotate(cold_after_days=args.cold_after_days):
+            print(f"Compressed {name}")
+    elif args.command == "rebuild-manifest":
+        manifest = SegmentedNDJSON(args.directory).rebuild_manifest()
+        print(f"Indexed {len(manifest['segments'])} segments")
+
+
+if __name__ == "__main__":
+    main()
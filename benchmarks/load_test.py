@@ -0,0 +1,372 @@
+# Concurrent-session load test for main.py, built on Streamlit's headless AppTest.
+#
+# N simulated users log in, tick their medication checkboxes and save their
+# profile at the same time, against generated data in a scratch copy of the app.
+# The report has rerun latency percentiles per interaction, MedicationAdministration
+# append and Patient.ndjson save timings, and process memory. Save it with --output
+# and pass it back with --compare to see regressions between runs.
+#
+#   python benchmarks/load_test.py --sessions 20 --output before.json
+#   python benchmarks/load_test.py --sessions 20 --compare before.json
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+APP_FILES = ["main.py", "main.css", "default_user.png"]
+APP_DIRS = ["fhir_data"]
+PATIENT_TEMPLATE = "fhir_data/patient/Patient.ndjson"
+REQUEST_TEMPLATE = "fhir_data/medication_request/MedicationRequest.ndjson"
+
+
+# Copy the app into workdir and generate one account, patient and set of prescriptions per session
+def build_workdir(workdir, sessions):
+    for name in APP_FILES:
+        shutil.copy(os.path.join(repo_root, name), workdir)
+    for name in os.listdir(repo_root):
+        if name.endswith(".py") and name not in APP_FILES:
+            shutil.copy(os.path.join(repo_root, name), workdir)
+    for name in APP_DIRS:
+        shutil.copytree(os.path.join(repo_root, name), os.path.join(workdir, name))
+    os.makedirs(os.path.join(workdir, "app_data"), exist_ok=True)
+
+    with open(os.path.join(repo_root, PATIENT_TEMPLATE), "r") as f:
+        patient_template = json.loads(f.readline())
+    with open(os.path.join(repo_root, REQUEST_TEMPLATE), "r") as f:
+        request_templates = [json.loads(line) for line in f if line.strip()]
+
+    accounts = []
+    with open(os.path.join(workdir, PATIENT_TEMPLATE), "w") as patients, \
+            open(os.path.join(workdir, REQUEST_TEMPLATE), "w") as requests:
+        for i in range(sessions):
+            patient_id = str(uuid.uuid4())
+            patient = dict(patient_template, id=patient_id)
+            patient["name"] = [{"use": "official", "family": f"User{i}", "given": ["Load"]}]
+            patients.write(json.dumps(patient) + "\n")
+            for template in request_templates:
+                request = dict(template, id=str(uuid.uuid4()), subject={"reference": f"Patient/{patient_id}"})
+                requests.write(json.dumps(request) + "\n")
+            accounts.append({"username": f"user{i}", "password": "load-test", "first_name": "Load",
+                             "last_name": f"User{i}", "patient_id": patient_id})
+    with open(os.path.join(workdir, "app_data/user_accounts.json"), "w") as f:
+        json.dump(accounts, f)
+    return accounts
+
+
+# Times every MedicationAdministration segment append, including the wait for its lock
+class WriteRecorder:
+    def __init__(self):
+        self.durations = []
+        self._lock = threading.Lock()
+
+    def install(self):
+        import admin_segments
+        original = admin_segments.SegmentedNDJSON.append_many
+        recorder = self
+
+        def timed_append_many(self, records):
+            t0 = time.perf_counter()
+            try:
+                return original(self, records)
+            finally:
+                with recorder._lock:
+                    recorder.durations.append(time.perf_counter() - t0)
+
+        admin_segments.SegmentedNDJSON.append_many = timed_append_many
+
+
+# Times each Patient.ndjson save's read-modify-write window: from the save opening
+# the file to read it until its new copy replaces the file, in the same thread.
+# save_patient_data is redefined on every script run, so the file calls are wrapped.
+class PatientSaveRecorder:
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.durations = []
+        self._lock = threading.Lock()
+        self._opened = threading.local()
+
+    def install(self):
+        import builtins
+        original_open, original_replace = builtins.open, os.replace
+        recorder = self
+
+        def timed_open(file, *args, **kwargs):
+            if isinstance(file, str) and os.path.abspath(file) == recorder.path:
+                recorder._opened.at = time.perf_counter()
+            return original_open(file, *args, **kwargs)
+
+        def timed_replace(src, dst, *args, **kwargs):
+            result = original_replace(src, dst, *args, **kwargs)
+            opened = getattr(recorder._opened, "at", None)
+            if opened is not None and os.path.abspath(dst) == recorder.path:
+                recorder._opened.at = None
+                with recorder._lock:
+                    recorder.durations.append(time.perf_counter() - opened)
+            return result
+
+        builtins.open = timed_open
+        os.replace = timed_replace
+
+
+# Parsing and compiling ASTs is not thread-safe on some CPython versions ("AST
+# constructor recursion depth mismatch"), so only Streamlit's script compile step
+# (ast.parse, magic rewriting and compile) is serialized
+def serialize_script_compile():
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    original = ScriptCache.get_bytecode
+    lock = threading.Lock()
+
+    def get_bytecode(self, script_path):
+        with lock:
+            return original(self, script_path)
+
+    ScriptCache.get_bytecode = get_bytecode
+
+
+# AppTest expects one run at a time: each run installs a mock Runtime and patches
+# the config into testing mode, then undoes both when it ends, under any session
+# still running. Testing mode is set once for the whole process instead, and the
+# last mock Runtime installed stays available to every session.
+def share_test_globals():
+    from contextlib import nullcontext
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.testing.v1 import app_test
+    from streamlit.testing.v1.util import build_mock_config_get_option
+
+    config.get_option = build_mock_config_get_option({"global.appTest": True})
+    app_test.patch_config_options = lambda overrides: nullcontext()
+    last = []
+
+    def current(cls):
+        if cls._instance is not None:
+            last[:] = [cls._instance]
+        return last[0] if last else None
+
+    def instance(cls):
+        runtime = current(cls)
+        if runtime is None:
+            raise RuntimeError("Runtime hasn't been created!")
+        return runtime
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(lambda cls: current(cls) is not None)
+
+
+class Session:
+    def __init__(self, account, timeout):
+        self.account = account
+        self.timeout = timeout
+        self.latencies = {}  # interaction -> [seconds]
+        self.errors = []
+        self.checked = 0
+
+    def _timed(self, name, action):
+        t0 = time.perf_counter()
+        at = action()
+        self.latencies.setdefault(name, []).append(time.perf_counter() - t0)
+        if at is not None and len(at.exception):
+            self.errors.append(f"{name}: {at.exception[0].message}")
+        return at
+
+    def run(self, main_path, barrier):
+        from streamlit.testing.v1 import AppTest
+
+        try:
+            at = AppTest.from_file(main_path, default_timeout=self.timeout)
+            barrier.wait()
+            self._timed("initial load", at.run)
+            at.text_input[0].input(self.account["username"])
+            at.text_input[1].input(self.account["password"])
+            self._timed("login", at.button[0].click().run)
+
+            for checkbox in list(at.checkbox):
+                if checkbox.key and checkbox.key.startswith("med_checkbox_") and not checkbox.value:
+                    self._timed("tick medication", at.checkbox(key=checkbox.key).check().run)
+                    self.checked += 1
+
+            first_name = next(t for t in at.text_input if t.label == "First Name")
+            first_name.input(f"Load-{self.account['username']}")
+            # The save button is drawn above the form, so the edit needs its own rerun first
+            self._timed("edit profile", at.run)
+            save = next(b for b in at.button if "Save Profile" in b.label)
+            self._timed("save profile", save.click().run)
+            self._timed("rerun", at.run)
+        except Exception as e:
+            self.errors.append(f"{type(e).__name__}: {e}")
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 2) if values else None,
+        "p90_ms": round(percentile(values, 90) * 1000, 2) if values else None,
+        "p99_ms": round(percentile(values, 99) * 1000, 2) if values else None,
+        "max_ms": round(max(values) * 1000, 2) if values else None,
+    }
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+# Check what actually landed on disk: valid administration lines and surviving profile saves
+def check_files(workdir, accounts):
+    patient_refs = {f"Patient/{a['patient_id']}" for a in accounts}
+    admin_dir = os.path.join(workdir, "fhir_data/medication_administration")
+    written, corrupt = 0, 0
+    for name in os.listdir(admin_dir):
+        if not name.endswith(".ndjson"):
+            continue
+        with open(os.path.join(admin_dir, name), "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    written += record.get("subject", {}).get("reference") in patient_refs
+                except ValueError:
+                    corrupt += 1
+
+    saved = 0
+    with open(os.path.join(workdir, PATIENT_TEMPLATE), "r") as f:
+        for line in f:
+            patient = json.loads(line)
+            saved += patient.get("name", [{}])[0].get("given", [""])[0].startswith("Load-")
+    return written, corrupt, saved
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="medtracker-load-")
+    try:
+        accounts = build_workdir(workdir, args.sessions)
+        os.chdir(workdir)  # main.py uses paths relative to the working directory
+        sys.path.insert(0, workdir)
+        recorder = WriteRecorder()
+        recorder.install()
+        save_recorder = PatientSaveRecorder(PATIENT_TEMPLATE)
+        save_recorder.install()
+        serialize_script_compile()
+        share_test_globals()
+
+        rss_before = current_rss_mb()
+        sessions = [Session(account, args.timeout) for account in accounts]
+        barrier = threading.Barrier(len(sessions))
+        threads = [threading.Thread(target=s.run, args=(os.path.join(workdir, "main.py"), barrier)) for s in sessions]
+        t0 = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - t0
+
+        written, corrupt, saved = check_files(workdir, accounts)
+        interactions = {}
+        for session in sessions:
+            for name, values in session.latencies.items():
+                interactions.setdefault(name, []).extend(values)
+        total_interactions = sum(len(v) for v in interactions.values())
+        expected_writes = sum(s.checked for s in sessions)
+
+        return {
+            "config": {"sessions": args.sessions, "python": platform.python_version(),
+                       "started": datetime.now().isoformat(timespec="seconds")},
+            "wall_s": round(wall, 2),
+            "throughput_per_s": round(total_interactions / wall, 2) if wall else None,
+            "interactions": {name: summarize(values) for name, values in interactions.items()},
+            "medication_administration_writes": dict(summarize(recorder.durations), expected=expected_writes,
+                                                     on_disk=written, corrupt_lines=corrupt),
+            "patient_saves": dict(summarize(save_recorder.durations), expected=args.sessions,
+                                  survived=saved, lost=args.sessions - saved),
+            "memory_mb": {"rss_before": round(rss_before, 1) if rss_before else None,
+                          "rss_after": round(current_rss_mb(), 1) if current_rss_mb() else None,
+                          "peak_rss": round(peak_rss_mb(), 1)},
+            "errors": [e for s in sessions for e in s.errors][:20],
+        }
+    finally:
+        os.chdir(repo_root)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_report(report, baseline=None):
+    def delta(new, old):
+        if new is None or old is None:
+            return ""
+        return f" ({new - old:+.2f})"
+
+    base_interactions = (baseline or {}).get("interactions", {})
+    print(f"{report['config']['sessions']} sessions, {report['wall_s']} s wall, "
+          f"{report['throughput_per_s']} interactions/s"
+          + delta(report["throughput_per_s"], (baseline or {}).get("throughput_per_s")))
+    print(f"{'interaction':<16} {'count':>6} {'p50 ms':>22} {'p90 ms':>22} {'p99 ms':>22} {'max ms':>22}")
+    for name, stats in report["interactions"].items():
+        old = base_interactions.get(name, {})
+        cells = [f"{stats[k]}{delta(stats[k], old.get(k))}" for k in ("p50_ms", "p90_ms", "p99_ms", "max_ms")]
+        print(f"{name:<16} {stats['count']:>6} " + " ".join(f"{c:>22}" for c in cells))
+
+    def timings(stats, old, action):
+        return ", ".join(f"{action} {label} {stats.get(k)} ms{delta(stats.get(k), old.get(k))}"
+                         for label, k in (("p50", "p50_ms"), ("p99", "p99_ms"), ("max", "max_ms")))
+
+    writes = report["medication_administration_writes"]
+    print(f"administration writes: {writes['on_disk']}/{writes['expected']} on disk, "
+          f"{writes['corrupt_lines']} corrupt lines, "
+          + timings(writes, (baseline or {}).get("medication_administration_writes", {}), "append"))
+    saves = report["patient_saves"]
+    print(f"Patient.ndjson saves: {saves['survived']}/{saves['expected']} survived, {saves['lost']} lost, "
+          + timings(saves, (baseline or {}).get("patient_saves", {}), "save"))
+    memory = report["memory_mb"]
+    print(f"memory: rss {memory['rss_before']} -> {memory['rss_after']} MiB, peak {memory['peak_rss']} MiB"
+          + delta(memory["peak_rss"], (baseline or {}).get("memory_mb", {}).get("peak_rss")))
+    for error in report["errors"]:
+        print(f"error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive N concurrent simulated sessions through main.py")
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=120, help="seconds allowed per rerun")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--compare", help="earlier JSON report to show deltas against")
+    parser.add_argument("--keep", action="store_true", help="keep the generated working directory")
+    args = parser.parse_args()
+
+    report = run(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
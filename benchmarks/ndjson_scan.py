@@ -0,0 +1,125 @@
+# Benchmark for MappedNDJSON: scan a large NDJSON store for the fields the app
+# reads (resourceType, status, subject.reference, the medication coding and
+# effectiveDateTime) and compare against raw I/O, against decoding every line and
+# keeping it (load_ndjson) and against decoding one line at a time (stream loads).
+# MedicationAdministration data by default, Observation with --source.
+#
+#   python benchmarks/ndjson_scan.py --size-mb 500
+#   python benchmarks/ndjson_scan.py --size-mb 500 --source observation
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+repo_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, repo_root)
+
+from ndjson_mmap import MappedNDJSON  # noqa: E402
+
+SOURCES = {
+    "administration": ("fhir_data/medication_administration", "MedicationAdministration", "completed"),
+    "observation": ("fhir_data/observation", "Observation", "final"),
+}
+FIELDS = ["resourceType", "status", "subject.reference", "medicationCodeableConcept.coding", "effectiveDateTime"]
+
+
+# Repeat the source's sample NDJSON until the file reaches size_mb
+def build_file(path, size_mb, source):
+    directory = os.path.join(repo_root, SOURCES[source][0])
+    sample = b""
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".ndjson"):
+            with open(os.path.join(directory, name), "rb") as f:
+                sample += f.read()
+    with open(path, "wb") as out:
+        while out.tell() < size_mb * 2**20:
+            out.write(sample)
+
+
+def raw_io(path):
+    total = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            total += len(chunk)
+    return total
+
+
+def get_path(record, path):
+    for part in path.split("."):
+        record = record.get(part) if isinstance(record, dict) else None
+    return record
+
+
+# What load_ndjson does: decode every line and keep the dicts
+def load_ndjson(path, resource_type, status):
+    with open(path, "r") as f:
+        records = [json.loads(line) for line in f]
+    count = 0
+    for r in records:
+        values = [get_path(r, field) for field in FIELDS]
+        count += values[0] == resource_type and values[1] == status and values[4] is not None
+    return count
+
+
+# What SegmentedNDJSON.read does: decode one line at a time without keeping it
+def stream_loads(path, resource_type, status):
+    count = 0
+    with open(path, "rb") as f:
+        for line in f:
+            r = json.loads(line)
+            values = [get_path(r, field) for field in FIELDS]
+            count += values[0] == resource_type and values[1] == status and values[4] is not None
+    return count
+
+
+def mapped_scan(path, resource_type, status):
+    count = 0
+    with MappedNDJSON(path) as records:
+        for view in records:
+            values = [view.get(field) for field in FIELDS]
+            count += values[0] == resource_type and values[1] == status and values[4] is not None
+    return count
+
+
+# Selective lookup: lines without the value's bytes are never decoded
+def mapped_where(path, resource_type, status):
+    with MappedNDJSON(path) as records:
+        first_id = records[0].get("id")
+        return sum(1 for _ in records.where("id", first_id))
+
+
+# Timed without tracemalloc (it slows every allocation down), then run again for the peak heap
+def measure(name, fn, *args):
+    t0 = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - t0
+    tracemalloc.start()
+    fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<14} {elapsed:>8.2f} s  {peak / 2**20:>8.2f} MiB peak heap  (result {result})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare mmap field scans with full NDJSON decoding")
+    parser.add_argument("--size-mb", type=int, default=100)
+    parser.add_argument("--source", choices=sorted(SOURCES), default="administration")
+    args = parser.parse_args()
+    _, resource_type, status = SOURCES[args.source]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f"{resource_type}.ndjson")
+        build_file(path, args.size_mb, args.source)
+        print(f"{os.path.getsize(path) / 2**20:.0f} MiB {resource_type} NDJSON, fields: {', '.join(FIELDS)}")
+        measure("raw I/O", raw_io, path)
+        measure("load_ndjson", load_ndjson, path, resource_type, status)
+        measure("stream loads", stream_loads, path, resource_type, status)
+        measure("mmap fields", mapped_scan, path, resource_type, status)
+        measure("mmap where", mapped_where, path, resource_type, status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# Benchmark for ReminderScheduler: schedule, cancel and fire reminders for many
+# patients and report per-operation latency (mean, p99, max) and memory per
+# pending reminder. Heap compaction runs in run_forever, so it is timed on its own.
+#
+#   python benchmarks/reminder_scheduler.py --patients 100000
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from reminder_scheduler import ReminderScheduler  # noqa: E402
+
+
+def latency_summary(samples):
+    samples = sorted(samples)
+    mean = sum(samples) / len(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    return f"mean {mean * 1e6:.2f} us, p99 {p99 * 1e6:.2f} us, max {samples[-1] * 1e6:.2f} us"
+
+
+class CountingNotifier:
+    def __init__(self):
+        self.sent = 0
+
+    def notify(self, reminder):
+        self.sent += 1
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dose reminder scheduler")
+    parser.add_argument("--patients", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    start = datetime(2025, 1, 1)
+    notifier = CountingNotifier()
+    scheduler = ReminderScheduler(notifier, clock=lambda: start)
+    patient_ids = [f"patient-{i}" for i in range(args.patients)]
+    dues = [start + timedelta(seconds=rng.randrange(86400)) for _ in patient_ids]
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    for patient_id, due in zip(patient_ids, dues):
+        scheduler.schedule(patient_id, "309362", due, "Clopidogrel 75 MG Oral Tablet", "1 tablet")
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Timed separately from the memory pass; tracemalloc slows every allocation down
+    schedule_times = []
+    for patient_id, due in zip(patient_ids, dues):
+        t0 = time.perf_counter()
+        scheduler.schedule(patient_id, "309362", due, "Clopidogrel 75 MG Oral Tablet", "1 tablet")
+        schedule_times.append(time.perf_counter() - t0)
+
+    cancel_times = []
+    for patient_id in rng.sample(patient_ids, args.patients // 2):
+        t0 = time.perf_counter()
+        scheduler.cancel(patient_id, "309362")
+        cancel_times.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    scheduler.compact()
+    compact_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    fired = scheduler.run_pending(now=start + timedelta(hours=12))
+    fire_time = time.perf_counter() - t0
+
+    n = args.patients
+    print(f"patients:            {n}")
+    print(f"schedule:            {latency_summary(schedule_times)}")
+    print(f"cancel:              {latency_summary(cancel_times)}")
+    print(f"compact (background): {compact_time * 1e3:.2f} ms")
+    print(f"fire (incl. notify): {fire_time / max(fired, 1) * 1e6:.2f} us/op ({fired} fired)")
+    print(f"memory:              {(after - before) / n:.0f} bytes per pending reminder")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# Memory benchmark: N sessions each loading their own copies of the FHIR data
+# (the old per-session design) against N sessions querying one shared FHIRStore.
+#
+#   python benchmarks/store_memory.py --sessions 1 10 100 --scale 20
+import argparse
+import json
+import os
+import sys
+import tracemalloc
+import uuid
+
+repo_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, repo_root)
+
+from admin_segments import SegmentedNDJSON  # noqa: E402
+from fhir_store import FHIRStore, extract_medication  # noqa: E402
+
+med_request_path = os.path.join(repo_root, "fhir_data/medication_request/MedicationRequest.ndjson")
+med_admin_dir = os.path.join(repo_root, "fhir_data/medication_administration")
+
+
+# Repeat records `scale` times with fresh ids, as NDJSON lines
+def scale_records(records, scale):
+    result = []
+    for _ in range(scale):
+        for record in records:
+            record = dict(record, id=str(uuid.uuid4()))
+            result.append(json.dumps(record))
+    return result
+
+
+# What every session did before: decode both files and extract its own medication dicts
+def per_session_copy(request_lines, admin_lines):
+    med_requests = [json.loads(line) for line in request_lines]
+    med_administrations = [json.loads(line) for line in admin_lines]
+    active_medications, stopped_medications = [], []
+    for entry in med_requests:
+        med = extract_medication(entry)
+        (active_medications if entry.get("status") == "active" else stopped_medications).append(med)
+    return med_requests, med_administrations, active_medications, stopped_medications
+
+
+def shared_store_query(store, patient_id):
+    active_medications, stopped_medications = store.medications(patient_id)
+    return store.administrations(patient_id), active_medications, stopped_medications
+
+
+def measure(build):
+    tracemalloc.start()
+    kept = build()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return current, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-session FHIR data copies with one shared FHIRStore")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--scale", type=int, default=10, help="repeat the sample data this many times")
+    args = parser.parse_args()
+
+    with open(med_request_path, "r") as f:
+        request_lines = scale_records([json.loads(line) for line in f if line.strip()], args.scale)
+    admin_lines = scale_records(list(SegmentedNDJSON(med_admin_dir).read()), args.scale)
+    patient_id = json.loads(request_lines[0]).get("subject", {}).get("reference", "").split("/")[-1]
+
+    print(f"{len(request_lines)} MedicationRequest, {len(admin_lines)} MedicationAdministration records")
+    print(f"{'sessions':>8}  {'per-session MiB':>16}  {'shared store MiB':>17}  {'ratio':>6}")
+    for n in args.sessions:
+        old_current, _ = measure(lambda: [per_session_copy(request_lines, admin_lines) for _ in range(n)])
+
+        def build_shared():
+            store = FHIRStore()
+            store.add_medication_requests([json.loads(line) for line in request_lines])
+            store.add_administrations([json.loads(line) for line in admin_lines])
+            return store, [shared_store_query(store, patient_id) for _ in range(n)]
+
+        new_current, _ = measure(build_shared)
+        print(f"{n:>8}  {old_current / 2**20:>16.2f}  {new_current / 2**20:>17.2f}  {old_current / new_current:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import threading
+
+
+RXNORM_SYSTEM = "http://www.nlm.nih.gov/research/umls/rxnorm"
+
+
+# Build the medication dict the UI works with from a MedicationRequest
+def extract_medication(entry):
+    med_text = entry.get("medicationCodeableConcept", {}).get("text", "Unknown")
+    coding = next((c for c in entry.get("medicationCodeableConcept", {}).get("coding", []) if c.get("system") == RXNORM_SYSTEM), {})
+    dosage = entry.get("dosageInstruction", [{}])[0].get("text", "Dosage not specified")
+    prescriber = entry.get("requester", {}).get("display", "Unknown Prescriber")
+    effective_date = entry.get("authoredOn", "Unknown Date")
+    return {
+        "Medication": med_text,
+        "Dosage": dosage,
+        "Prescriber": prescriber,
+        "Effective Date": effective_date,
+        "RequestID": entry.get("id", ""),
+        "RXnormCode": coding.get("code", ""),
+        "RXnormSystem": coding.get("system", ""),
+        "RXnormDisplay": coding.get("display", med_text),
+        "Original": entry
+    }
+
+
+# Sort key for choosing between MedicationRequests for the same medication: prefer
+# the active prescription, then the most recently authored one, then the larger id
+def request_rank(request):
+    return request.get("status") == "active", request.get("authoredOn", ""), request.get("id", "")
+
+
+# Get the medication ID (RXnorm code, or text as fallback) from an administration
+def get_administration_med_id(admin):
+    admin_med_id = None
+    for coding in admin.get("medicationCodeableConcept", {}).get("coding", []):
+        if coding.get("system") == RXNORM_SYSTEM:
+            admin_med_id = coding.get("code")
+            break
+
+    if not admin_med_id:
+        admin_med_id = admin.get("medicationCodeableConcept", {}).get("text", "")
+    return admin_med_id
+
+
+# Get the patient id a resource belongs to from its subject reference
+def get_subject_patient_id(resource):
+    reference = resource.get("subject", {}).get("reference", "")
+    if reference.startswith("Patient/"):
+        return reference[len("Patient/"):]
+    return ""
+
+
+# Many readers or one writer at a time; waiting writers block new readers
+class ReadWriteLock:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+# Immutable view of one patient's records. Writers never modify it in place, they
+# build a new one for the patient they touch and swap it into the store.
+class PatientSnapshot:
+    def __init__(self, requests=(), administrations=(), medications=((), ()), admin_ids=frozenset()):
+        self.requests = requests  # tuple of MedicationRequest
+        self.administrations = administrations  # tuple of MedicationAdministration
+        self.medications = medications  # (active tuple, stopped tuple)
+        self.admin_ids = admin_ids  # ids of this patient's administrations
+
+
+EMPTY_PATIENT = PatientSnapshot()
+
+
+# Process-wide FHIR store shared by all sessions and queried by patient. A write
+# replaces only the snapshots of the patients it touches, so its cost does not
+# grow with the number of patients or records in the store.
+class FHIRStore:
+    def __init__(self):
+        self._lock = ReadWriteLock()
+        self._patients = {}  # patient id -> PatientSnapshot
+
+    # An empty patient id (an account with no linked patient) has no records.
+    # Records without a patient subject are only returned by all_patients().
+    def patient(self, patient_id):
+        if not patient_id:
+            return EMPTY_PATIENT
+        self._lock.acquire_read()
+        try:
+            return self._patients.get(patient_id, EMPTY_PATIENT)
+        finally:
+            self._lock.release_read()
+
+    def all_patients(self):
+        self._lock.acquire_read()
+        try:
+            return list(self._patients.values())
+        finally:
+            self._lock.release_read()
+
+    # Requests already in the store (by id) are replaced in place, so a prescription
+    # whose status changes moves between the active and stopped lists
+    def add_medication_requests(self, entries):
+        entries = [e for e in entries if e.get("resourceType") == "MedicationRequest"]
+        if not entries:
+            return
+        groups = _group_by_patient(entries)
+        self._lock.acquire_write()
+        try:
+            for patient_id, group in groups.items():
+                old = self._patients.get(patient_id, EMPTY_PATIENT)
+                by_id = {e.get("id") or id(e): e for e in old.requests}
+                for e in group:
+                    by_id[e.get("id") or id(e)] = e
+                requests = tuple(by_id.values())
+                medications = (tuple(extract_medication(e) for e in requests if e.get("status") == "active"),
+                               tuple(extract_medication(e) for e in requests if e.get("status") != "active"))
+                self._patients[patient_id] = PatientSnapshot(requests, old.administrations,
+                                                             medications, old.admin_ids)
+        finally:
+            self._lock.release_write()
+
+    # Administrations already in the store (by id) are skipped, so a session's own
+    # write and the watcher's copy of the same line are only stored once
+    def add_administrations(self, entries):
+        entries = [e for e in entries if e.get("resourceType") == "MedicationAdministration"]
+        if not entries:
+            return
+        groups = _group_by_patient(entries)
+        self._lock.acquire_write()
+        try:
+            for patient_id, group in groups.items():
+                old = self._patients.get(patient_id, EMPTY_PATIENT)
+                new_ids = set()
+                fresh = []
+                for e in group:
+                    admin_id = e.get("id")
+                    if admin_id and (admin_id in old.admin_ids or admin_id in new_ids):
+                        continue
+                    new_ids.add(admin_id)
+                    fresh.append(e)
+                if fresh:
+                    self._patients[patient_id] = PatientSnapshot(old.requests, old.administrations + tuple(fresh),
+                                                                 old.medications, old.admin_ids | new_ids)
+        finally:
+            self._lock.release_write()
+
+    # Patient queries; use all_patients() for records across patients
+    def medication_requests(self, patient_id):
+        return self.patient(patient_id).requests
+
+    def administrations(self, patient_id):
+        return self.patient(patient_id).administrations
+
+    def medications(self, patient_id):
+        return self.patient(patient_id).medications
+
+
+def _group_by_patient(entries):
+    groups = {}
+    for e in entries:
+        groups.setdefault(get_subject_patient_id(e), []).append(e)
+    return groups
+
@@ -1,20 +1,31 @@
 import streamlit as st
 import pandas as pd
 import json
+import os
 import uuid
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import plotly.graph_objects as go
 import smtplib
+import tempfile
+from ndjson_watcher import NDJSONWatcher
+from ndjson_mmap import MappedNDJSON
+from fhir_store import FHIRStore, get_administration_med_id
+from admin_segments import SegmentedNDJSON
+from adherence_export import EXPORT_FORMATS, export_adherence
+from reference_index import REFERENCE_STORES, ReferenceIndex, reference_key
 
 
 st.set_page_config(page_title="Medication Tracker", layout="centered", initial_sidebar_state="auto")
 
 # File paths
 patient_file_path = "fhir_data/patient/Patient.ndjson"
-med_admin_path = "fhir_data/medication_administration/MedicationAdministration.ndjson"
+med_admin_dir = "fhir_data/medication_administration"  # Monthly MedicationAdministration segments
 med_request_path = "fhir_data/medication_request/MedicationRequest.ndjson"
 editable_profile_path = "editable_profile.json"
 user_accounts_path = "app_data/user_accounts.json"  # Added path for user accounts
+admin_history_days = 90  # Administrations kept in memory; older ones are read from segments on demand
+admin_refresh_seconds = 5  # How often an open checklist picks up administrations recorded elsewhere
+max_export_days = 366  # Longest date range the Analytics tab exports
 
 # Define help section function
 def help_section():
@@ -64,20 +75,16 @@ def load_user_accounts():
 @st.cache_data
 def load_patient(patient_id=None):
     try:
-        with open(patient_file_path, "r") as file:
-            patient_data = json.loads(file.readline())
-            # If a specific patient ID is provided, try to load that patient instead
+        with MappedNDJSON(patient_file_path) as patients:
+            # If a specific patient ID is provided, try to load that patient instead.
+            # Only the matching line is fully decoded.
             if patient_id:
-                # Reset file pointer and search for the patient with matching ID
-                file.seek(0)
-                for line in file:
+                for patient in patients.where("id", patient_id):
                     try:
-                        patient = json.loads(line)
-                        if patient.get("id") == patient_id:
-                            return patient
+                        return patient.decode()
                     except:
                         continue
-            return patient_data
+            return patients[0].decode()
     except Exception as e:
         st.error(f"Error loading patient data: {e}")
         return {}
@@ -258,11 +265,20 @@ def save_patient_data(patient_data):
         if not updated:
             return False, f"Patient with ID {patient_id} not found"
         
-        # Write all patients back to the file
+        # Write all patients to a new file and swap it in, so readers that have the
+        # old file open or memory-mapped never see it truncated. Each save gets its
+        # own temporary file, so concurrent saves never write into the same one.
         try:
-            with open(patient_file_path, "w") as file:
-                for p in all_patients:
-                    file.write(json.dumps(p) + "\n")
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(patient_file_path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as file:
+                    for p in all_patients:
+                        file.write(json.dumps(p) + "\n")
+                os.chmod(tmp_path, os.stat(patient_file_path).st_mode & 0o777)  # mkstemp creates it owner-only
+                os.replace(tmp_path, patient_file_path)
+            except Exception:
+                os.remove(tmp_path)
+                raise
             return True, "Patient data updated successfully"
         except Exception as e:
             return False, f"Error writing to patient file: {e}"
@@ -339,6 +355,16 @@ def get_user_profile(username):
             return profile
     return None
 
+# Get the date part of an administration's effectiveDateTime
+def get_administration_date(admin):
+    try:
+        admin_datetime = admin.get("effectiveDateTime", "")
+        if admin_datetime:
+            return admin_datetime.split("T")[0]  # Extract just the date part
+    except:
+        pass
+    return None
+
 # Check if medication was taken today
 def was_medication_taken_today(med_id, administrations):
     today = date.today().isoformat()
@@ -347,34 +373,82 @@ def was_medication_taken_today(med_id, administrations):
         if admin.get("resourceType") != "MedicationAdministration":
             continue
             
-        # Get the medication ID from the administration
-        admin_med_id = None
-        for coding in admin.get("medicationCodeableConcept", {}).get("coding", []):
-            if coding.get("system") == "http://www.nlm.nih.gov/research/umls/rxnorm":
-                admin_med_id = coding.get("code")
-                break
-                
-        if not admin_med_id:
-            admin_med_id = admin.get("medicationCodeableConcept", {}).get("text", "")
-            
         # Check if this is the medication we're looking for
-        if admin_med_id != med_id:
+        if get_administration_med_id(admin) != med_id:
             continue
             
         # Check if the administration was today
-        admin_date = None
-        try:
-            admin_datetime = admin.get("effectiveDateTime", "")
-            if admin_datetime:
-                admin_date = admin_datetime.split("T")[0]  # Extract just the date part
-        except:
-            continue
-            
-        if admin_date == today:
+        if get_administration_date(admin) == today:
             return True
             
     return False
 
+# Single FHIR store shared by every session; get_fhir_watcher fills it and keeps it current
+@st.cache_resource
+def get_fhir_store():
+    return FHIRStore()
+
+# Index of the Practitioner, Patient and Encounter stores for resolving references
+@st.cache_resource
+def get_reference_index():
+    return ReferenceIndex(REFERENCE_STORES)
+
+# Time-partitioned MedicationAdministration history
+@st.cache_resource
+def get_admin_segments():
+    return SegmentedNDJSON(med_admin_dir)
+
+# Shared watcher that tails the MedicationAdministration segments and
+# MedicationRequest.ndjson for every session. Listeners are added before the files
+# are loaded, so nothing written in between is missed: administrations seen twice
+# are skipped by id and requests seen twice are replaced by id. The store is filled
+# with recent administration history only.
+@st.cache_resource
+def get_fhir_watcher():
+    store = get_fhir_store()
+    watcher = NDJSONWatcher(interval=1.0)
+    watcher.watch(med_admin_dir)
+    watcher.add_listener(med_admin_dir, store.add_administrations)
+    watcher.add_listener(med_request_path, store.add_medication_requests)
+    store.add_medication_requests(load_ndjson(med_request_path))
+    # Read the segments before taking the store's write lock, so sessions are not blocked on disk I/O
+    recent = list(get_admin_segments().read(start=date.today() - timedelta(days=admin_history_days)))
+    store.add_administrations(recent)
+    watcher.start()
+    return watcher
+
+# Subscribe this session to administrations recorded for its patient
+def subscribe_to_administrations(patient_id):
+    if st.session_state.get("admin_subscription_patient") == patient_id and "admin_subscription" in st.session_state:
+        return
+    # An account with no linked patient has nothing to receive
+    subscription = None
+    if patient_id:
+        patient_ref = f"Patient/{patient_id}"
+        subscription = get_fhir_watcher().subscribe(med_admin_dir, lambda admin: admin.get("subject", {}).get("reference") == patient_ref)
+    st.session_state.admin_subscription = subscription
+    st.session_state.admin_subscription_patient = patient_id
+
+# Apply administrations recorded by other sessions or processes since the last rerun
+def apply_pushed_administrations():
+    subscription = st.session_state.get("admin_subscription")
+    if subscription is None or not subscription.pending():
+        return
+    today = date.today().isoformat()
+    checkbox_keys = {(med["RXnormCode"] or med["Medication"]): f"med_checkbox_{i}" for i, med in enumerate(active_medications)}
+    for admin in subscription.drain():
+        if admin.get("resourceType") != "MedicationAdministration":
+            continue
+        if get_administration_date(admin) != today:
+            continue
+        med_id = get_administration_med_id(admin)
+        if st.session_state.taken_medications.get(med_id):
+            continue
+        st.session_state.taken_medications[med_id] = True
+        # Drop the widget state so the checkbox is recreated as checked
+        if med_id in checkbox_keys:
+            st.session_state.pop(checkbox_keys[med_id], None)
+
 # Authenticate user
 def authenticate(username, password):
     user_accounts = load_user_accounts()
@@ -385,8 +459,8 @@ def authenticate(username, password):
 
 # Load data
 patient = load_patient()  # Default patient data (will be replaced with specific patient after login)
-med_requests = load_ndjson(med_request_path)
-med_administrations = load_ndjson(med_admin_path)
+store = get_fhir_store()
+get_fhir_watcher()  # Fills the store with requests and administrations and keeps it current
 
 # Session state
 if "username" not in st.session_state:
@@ -462,28 +536,15 @@ if st.button("Logout"):
     st.query_params.clear()
     st.rerun()
 
-# Extract medications
-active_medications, stopped_medications = [], []
-for entry in med_requests:
-    if entry.get("resourceType") != "MedicationRequest":
-        continue
-    med_text = entry.get("medicationCodeableConcept", {}).get("text", "Unknown")
-    coding = next((c for c in entry.get("medicationCodeableConcept", {}).get("coding", []) if c.get("system") == "http://www.nlm.nih.gov/research/umls/rxnorm"), {})
-    dosage = entry.get("dosageInstruction", [{}])[0].get("text", "Dosage not specified")
-    prescriber = entry.get("requester", {}).get("display", "Unknown Prescriber")
-    effective_date = entry.get("authoredOn", "Unknown Date")
-    med = {
-        "Medication": med_text,
-        "Dosage": dosage,
-        "Prescriber": prescriber,
-        "Effective Date": effective_date,
-        "RequestID": entry.get("id", ""),
-        "RXnormCode": coding.get("code", ""),
-        "RXnormSystem": coding.get("system", ""),
-        "RXnormDisplay": coding.get("display", med_text),
-        "Original": entry
-    }
-    (active_medications if entry.get("status") == "active" else stopped_medications).append(med)
+# Medications and administrations for this patient, read from the shared store.
+# These are shared between sessions and must not be modified. An account with no
+# linked patient gets an empty snapshot.
+patient_id = st.session_state.editable_profile.get("patient_id", "")
+active_medications, stopped_medications = store.medications(patient_id)
+med_administrations = store.administrations(patient_id)
+
+subscribe_to_administrations(patient_id)
+apply_pushed_administrations()
 
 # Custom CSS
 st.markdown("""
@@ -569,80 +630,91 @@ with home:
             return f"❌ Error sending email: {e}"
 
 
-    st.subheader("\u2705 Mark Active Medications as Administered")
-    
     # Check for already taken medications today from database
-    for med in active_medications:
+    for i, med in enumerate(active_medications):
         med_id = med["RXnormCode"] or med["Medication"]
         if med_id not in st.session_state.taken_medications:
             # Check if this medication was already taken today according to the database
             if was_medication_taken_today(med_id, med_administrations):
                 st.session_state.taken_medications[med_id] = True
+                st.session_state.pop(f"med_checkbox_{i}", None)
+
+    # Checking a box reruns only the checklist. Streamlit has no server push, so the
+    # checklist also reruns itself on a timer and applies what the watcher delivered;
+    # the rest of the page is not rerun.
+    @st.fragment(run_every=admin_refresh_seconds)
+    def medication_checklist():
+        apply_pushed_administrations()
+
+        st.subheader("\u2705 Mark Active Medications as Administered")
     
-    for i, med in enumerate(active_medications):
-        med_id = med["RXnormCode"] or med["Medication"]
-        k = f"med_checkbox_{i}"
+        for i, med in enumerate(active_medications):
+            med_id = med["RXnormCode"] or med["Medication"]
+            k = f"med_checkbox_{i}"
         
-        # Get initial value for checkbox - True if already taken today
-        initial_value = med_id in st.session_state.taken_medications and st.session_state.taken_medications[med_id]
+            # Get initial value for checkbox - True if already taken today
+            initial_value = med_id in st.session_state.taken_medications and st.session_state.taken_medications[med_id]
         
-        # Display checkbox with appropriate label
-        label = f"{med['Medication']} ({med['Dosage']}) - RXnorm: {med['RXnormCode'] or 'N/A'}"
-        if initial_value:
-            label += " ✓ (Taken today)"
+            # Display checkbox with appropriate label
+            label = f"{med['Medication']} ({med['Dosage']}) - RXnorm: {med['RXnormCode'] or 'N/A'}"
+            if initial_value:
+                label += " ✓ (Taken today)"
         
-        # Create the checkbox
-        checked = st.checkbox(label, value=initial_value, key=k)
+            # Create the checkbox
+            checked = st.checkbox(label, value=initial_value, key=k)
         
-        # If status changed from unchecked to checked
-        if checked and not initial_value:
-            # Record in session state
-            st.session_state.taken_medications[med_id] = True
+            # If status changed from unchecked to checked
+            if checked and not initial_value:
+                # Record in session state
+                st.session_state.taken_medications[med_id] = True
             
-            # Create MedicationAdministration entry
-            med_admin_entry = {
-                "resourceType": "MedicationAdministration",
-                "id": str(uuid.uuid4()),
-                "status": "completed",
-                "medicationCodeableConcept": {
-                    "coding": [
+                # Create MedicationAdministration entry
+                med_admin_entry = {
+                    "resourceType": "MedicationAdministration",
+                    "id": str(uuid.uuid4()),
+                    "status": "completed",
+                    "medicationCodeableConcept": {
+                        "coding": [
+                            {
+                                "system": med['RXnormSystem'] or "http://www.nlm.nih.gov/research/umls/rxnorm",
+                                "code": med['RXnormCode'] or "Unknown",
+                                "display": med['RXnormDisplay'] or med['Medication']
+                            }
+                        ],
+                        "text": med["Medication"]
+                    },
+                    "subject": med["Original"].get("subject", {"reference": f"Patient/{st.session_state.editable_profile.get('patient_id', '')}"}),
+                    "context": med["Original"].get("encounter", {"reference": f"Encounter/{str(uuid.uuid4())}"}),
+                    "effectiveDateTime": datetime.now().isoformat(),
+                    "reasonCode": med["Original"].get("reasonCode", [
                         {
-                            "system": med['RXnormSystem'] or "http://www.nlm.nih.gov/research/umls/rxnorm",
-                            "code": med['RXnormCode'] or "Unknown",
-                            "display": med['RXnormDisplay'] or med['Medication']
+                            "coding": [{
+                                "system": "http://terminology.hl7.org/CodeSystem/reason-medication-given",
+                                "code": "b",
+                                "display": "Given as Ordered"
+                            }],
+                            "text": "Self-administered medication"
                         }
-                    ],
-                    "text": med["Medication"]
-                },
-                "subject": med["Original"].get("subject", {"reference": f"Patient/{st.session_state.editable_profile.get('patient_id', '')}"}),
-                "context": med["Original"].get("encounter", {"reference": f"Encounter/{str(uuid.uuid4())}"}),
-                "effectiveDateTime": datetime.now().isoformat(),
-                "reasonCode": med["Original"].get("reasonCode", [
-                    {
-                        "coding": [{
-                            "system": "http://terminology.hl7.org/CodeSystem/reason-medication-given",
-                            "code": "b",
-                            "display": "Given as Ordered"
-                        }],
-                        "text": "Self-administered medication"
-                    }
-                ]),
-                "performer": [{"actor": {"display": "Patient"}}]
-            }
+                    ]),
+                    "performer": [{"actor": {"display": "Patient"}}]
+                }
             
-            # Write to NDJSON file
-            with open(med_admin_path, "a") as f:
-                f.write(json.dumps(med_admin_entry) + "\n")
+                # Write to this month's NDJSON segment. The watcher's copy of it is not pushed back to this session.
+                if st.session_state.admin_subscription is not None:
+                    st.session_state.admin_subscription.skip(med_admin_entry["id"])
+                get_admin_segments().append(med_admin_entry)
             
-            # Reload administrations to update the in-memory list
-            med_administrations.append(med_admin_entry)
+                # Add to the shared store right away; the watcher's copy is skipped by id
+                store.add_administrations([med_admin_entry])
             
-            st.success(f"✅ Recorded: {med['Medication']}")
+                st.success(f"✅ Recorded: {med['Medication']}")
             
-        # Update session state if checkbox was unchecked
-        elif not checked and initial_value:
-            st.session_state.taken_medications[med_id] = False
-            st.warning(f"⚠️ Unmarked: {med['Medication']} - Note: the database record still exists")
+            # Update session state if checkbox was unchecked
+            elif not checked and initial_value:
+                st.session_state.taken_medications[med_id] = False
+                st.warning(f"⚠️ Unmarked: {med['Medication']} - Note: the database record still exists")
+
+    medication_checklist()
 
     # Streamlit interface for email
     st.title("Send Test Email")
@@ -652,7 +724,7 @@ with home:
 
 # Medications
 with medications:
-    tab1, tab2 = st.tabs(["💊 Active Medications", "❌ Inactive Medications"])
+    tab1, tab2, tab3 = st.tabs(["💊 Active Medications", "❌ Inactive Medications", "🩺 Prescribers"])
     with tab1:
         for med in active_medications:
             med_id = med["RXnormCode"] or med["Medication"]
@@ -685,6 +757,42 @@ with medications:
                 """, unsafe_allow_html=True)
         else:
             st.info("No inactive medications found.")
+    with tab3:
+        # Resolve every prescriber on the page in one batch
+        all_medications = list(active_medications) + list(stopped_medications)
+        practitioners = get_reference_index().resolve_many(med["Original"].get("requester", {}) for med in all_medications)
+        prescribed = {}
+        for med in all_medications:
+            key = reference_key(med["Original"].get("requester", {}))
+            if key:
+                prescribed.setdefault(key, []).append(med["Medication"])
+
+        if not prescribed:
+            st.info("No prescribers found.")
+        for key, med_names in prescribed.items():
+            practitioner = practitioners.get(key)
+            if not practitioner:
+                st.markdown(f"<div class='medication-item'><b>{key}</b><br><span>Practitioner details not available</span></div>", unsafe_allow_html=True)
+                continue
+            name = practitioner.get("name", [{}])[0]
+            full_name = " ".join(name.get("prefix", []) + name.get("given", []) + [name.get("family", "")]).strip()
+            npi = next((i.get("value") for i in practitioner.get("identifier", []) if i.get("system") == "http://hl7.org/fhir/sid/us-npi"), "N/A")
+            specialty = ", ".join(q.get("code", {}).get("text", "") for q in practitioner.get("qualification", [])) or "Not Available"
+            email = next((t.get("value") for t in practitioner.get("telecom", []) if t.get("system") == "email"), "N/A")
+            phone = next((t.get("value") for t in practitioner.get("telecom", []) if t.get("system") == "phone"), "N/A")
+            address = practitioner.get("address", [{}])[0]
+            address_text = ", ".join(filter(None, [" ".join(address.get("line", [])), address.get("city", ""), f"{address.get('state', '')} {address.get('postalCode', '')}".strip()])) or "N/A"
+            st.markdown(f"""
+            <div class='medication-item'>
+                <b>{full_name}</b><br>
+                <span>NPI: {npi}</span><br>
+                <span>Specialty: {specialty}</span><br>
+                <span>Email: {email}</span><br>
+                <span>Phone: {phone}</span><br>
+                <span>Address: {address_text}</span><br>
+                <i>Prescribed: {", ".join(sorted(set(med_names)))}</i>
+            </div>
+            """, unsafe_allow_html=True)
 
 # Analytics
 with analytics:
@@ -696,6 +804,32 @@ with analytics:
     data = data.set_index("Day").sort_index()
     st.bar_chart(data)
 
+    st.subheader("📥 Export Adherence History")
+    if not patient_id:
+        st.info("No patient record is linked to this account, so there is no history to export.")
+    else:
+        export_format = st.selectbox("Format", list(EXPORT_FORMATS), format_func=lambda f: {"csv": "CSV", "bundle": "FHIR Bundle (JSON)", "parquet": "Parquet"}[f])
+        mime, extension = EXPORT_FORMATS[export_format]
+        export_range = st.date_input("Date range", (date.today() - timedelta(days=admin_history_days), date.today()), min_value=date(1900, 1, 1), max_value=date.today())
+
+        # Streamlit keeps a download in memory until it is served, so the app exports
+        # at most max_export_days at a time; the adherence_export.py CLI has no limit
+        if len(export_range) != 2:
+            st.info("Pick a start and an end date.")
+        elif (export_range[1] - export_range[0]).days >= max_export_days:
+            st.warning(f"Exports from the app are limited to {max_export_days} days. Use `python adherence_export.py` for the full history.")
+        else:
+            export_start, export_end = export_range
+
+            # Runs only when the button is clicked; the export is written in chunks to a temporary file
+            def build_export():
+                out = tempfile.TemporaryFile(buffering=0)  # Unbuffered file object that st.download_button accepts
+                export_adherence(export_format, out, store.medication_requests(patient_id), get_admin_segments(), patient_id, export_start, export_end)
+                out.seek(0)
+                return out
+
+            st.download_button("Download", data=build_export, file_name=f"adherence_history.{extension}", mime=mime)
+
 # Profile
 with profile:
     if st.button("💾 Save Profile"):
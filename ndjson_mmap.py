@@ -0,0 +1,264 @@
+import json
+import mmap
+import re
+from array import array
+
+
+# JSON string, written as runs of plain characters so the regex engine does not
+# step through strings one character at a time
+_STRING = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+
+# Strings and brackets, used to find where a deeply nested value ends
+_TOKEN_RE = re.compile(_STRING + rb'|[{}\[\]]')
+_STRING_RE = re.compile(_STRING)
+_SCALAR = rb'[^,{}\[\]\s"][^,}\]\s]*'  # Numbers, true, false, null; never the start of a string or container
+_SCALAR_RE = re.compile(_SCALAR)
+_KEY_RE = re.compile(rb'\s*(' + _STRING + rb')\s*:\s*')
+_SEPARATOR_RE = re.compile(rb'\s*([,}])')
+
+
+# An object or array nested up to depth levels, as one regex so skipping it stays
+# in C. Deeper values fall back to walking the tokens in _value_end.
+def _nested_pattern(depth):
+    plain = rb'[^"{}\[\]]*'
+    inner = plain + rb'(?:' + _STRING + plain + rb')*'
+    for _ in range(depth):
+        inner = plain + rb'(?:(?:' + _STRING + rb'|\{' + inner + rb'\}|\[' + inner + rb'\])' + plain + rb')*'
+    return rb'\{' + inner + rb'\}|\[' + inner + rb'\]'
+
+
+_NESTED_DEPTH = 6  # Enough for FHIR values such as Observation.component[].code.coding[]
+_NESTED = _nested_pattern(_NESTED_DEPTH)
+_NESTED_RE = re.compile(_NESTED)
+
+# One whole top-level member: key, value and the "," or "}" after it
+_MEMBER_RE = re.compile(rb'\s*(' + _STRING + rb')\s*:\s*(' + _STRING + rb'|' + _NESTED + rb'|' + _SCALAR + rb')\s*(?:,|(\}))')
+_KEY_RE_CACHE = {}
+
+
+def _key_pattern(key):
+    pattern = _KEY_RE_CACHE.get(key)
+    if pattern is None:
+        pattern = _KEY_RE_CACHE[key] = re.compile(rb'"' + re.escape(key.encode("utf-8")) + rb'"\s*:\s*')
+    return pattern
+
+
+# End of the JSON value starting at pos, without decoding it
+def _value_end(buffer, pos, end):
+    first = buffer[pos:pos + 1]
+    if first == b'"':
+        match = _STRING_RE.match(buffer, pos, end)
+        return match.end() if match else -1
+    if first in (b"{", b"["):
+        match = _NESTED_RE.match(buffer, pos, end)
+        if match:
+            return match.end()
+        depth = 0
+        for token in _TOKEN_RE.finditer(buffer, pos, end):
+            char = token.group()[:1]
+            if char in (b"{", b"["):
+                depth += 1
+            elif char in (b"}", b"]"):
+                depth -= 1
+                if depth == 0:
+                    return token.end()
+        return -1
+    match = _SCALAR_RE.match(buffer, pos, end)
+    return match.end() if match else -1
+
+
+_MISSING = object()
+
+
+# A single NDJSON line; only the requested field's value is decoded.
+# A field is found by searching for its key's bytes and checking that the match
+# is a top-level key: with no escapes before it, splitting on quotes separates
+# string contents from structure, so brackets can be counted in C. Lines with
+# escapes before the key are walked member by member instead, skipping nested
+# values without decoding them. The whole line is decoded only by decode() or
+# when it is not well-formed JSON.
+class RecordView:
+    __slots__ = ("_buffer", "_start", "_end", "_fields", "_spans", "_pos", "_record")
+
+    def __init__(self, buffer, start, end):
+        self._buffer = buffer
+        self._start = start
+        self._end = end
+        self._fields = None  # key -> decoded value
+        self._spans = None  # key -> (start, end) of the raw value, for members walked so far
+        self._pos = None  # where the walk continues; -1 once the line is fully walked
+        self._record = None
+
+    def raw(self):
+        return self._buffer[self._start:self._end]
+
+    def contains(self, needle):
+        if isinstance(needle, str):
+            needle = needle.encode("utf-8")
+        return self._buffer.find(needle, self._start, self._end) != -1
+
+    # Value of a top-level field, or a dotted path below it (e.g. "subject.reference")
+    def get(self, path, default=None):
+        key, _, rest = path.partition(".")
+        if self._record is None:
+            if self._fields is None:
+                self._fields = {}
+            value = self._fields.get(key, _MISSING)
+            if value is _MISSING:
+                value = self._fields[key] = self._scan(key)
+        if self._record is not None:
+            value = self._record.get(key, _MISSING)
+        for part in rest.split(".") if rest else ():
+            if not isinstance(value, dict):
+                return default
+            value = value.get(part, _MISSING)
+        return default if value is _MISSING else value
+
+    def _scan(self, key):
+        if self._spans is None:
+            self._spans = {}
+        span = self._spans.get(key)
+        if span is None:
+            span = self._find(key)
+            if span is None:
+                return _MISSING
+        value = self._buffer[span[0]:span[1]]
+        # Plain strings (most scanned fields) need no JSON decoding
+        if value[:1] == b'"' and b"\\" not in value:
+            return value[1:-1].decode("utf-8")
+        try:
+            return json.loads(value)
+        except ValueError:
+            return _MISSING
+
+    # Span of key's value when it is a top-level key, or None
+    def _find(self, key):
+        buffer, start, end = self._buffer, self._start, self._end
+        pattern = _key_pattern(key)
+        match = pattern.search(buffer, start, end)
+        while match is not None:
+            prefix = buffer[start:match.start()]
+            if b"\\" in prefix:
+                return self._walk(key.encode("utf-8"))
+            parts = prefix.split(b'"')
+            # An even number of quotes before the match puts it outside any string
+            if len(parts) % 2 == 1:
+                structure = b"".join(parts[::2])
+                depth = structure.count(b"{") + structure.count(b"[") - structure.count(b"}") - structure.count(b"]")
+                if depth == 1:
+                    value_end = _value_end(buffer, match.end(), end)
+                    return (match.end(), value_end) if value_end != -1 else None
+            match = pattern.search(buffer, match.end(), end)
+        return None
+
+    # Walk top-level members until key is found; returns its value's span or None
+    def _walk(self, key):
+        buffer, end, spans = self._buffer, self._end, self._spans
+        pos = self._pos
+        if pos is None:
+            pos = buffer.find(b"{", self._start, end) + 1
+            if pos == 0:
+                return self._fallback()
+        while pos != -1:
+            member = _MEMBER_RE.match(buffer, pos, end)
+            if member is not None:
+                name, value_start, value_end = member.group(1)[1:-1], member.start(2), member.end(2)
+                pos = -1 if member.group(3) else member.end()
+            else:
+                # A value nested too deeply for _MEMBER_RE, an empty object, or a malformed line
+                member = _KEY_RE.match(buffer, pos, end)
+                if member is None:
+                    if _SEPARATOR_RE.match(buffer, pos, end) is None:
+                        return self._fallback()
+                    self._pos = -1
+                    return None
+                name, value_start = member.group(1)[1:-1], member.end()
+                value_end = _value_end(buffer, value_start, end)
+                separator = _SEPARATOR_RE.match(buffer, value_end, end) if value_end != -1 else None
+                if separator is None:
+                    return self._fallback()
+                pos = separator.end() if separator.group(1) == b"," else -1
+            self._pos = pos
+            spans.setdefault(name.decode("utf-8"), (value_start, value_end))
+            if name == key:
+                return value_start, value_end
+        return None
+
+    # Malformed or unusual line: decode it whole and serve fields from the dict
+    def _fallback(self):
+        self._pos = -1
+        try:
+            self._record = self.decode()
+        except ValueError:
+            pass
+        return None
+
+    def decode(self):
+        if self._record is not None:
+            return self._record
+        return json.loads(self.raw())
+
+
+# Memory-maps an NDJSON file and keeps only a table of line offsets, so records
+# are read straight from the page cache and decoded field by field on demand.
+class MappedNDJSON:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._mm = b""  # Empty files cannot be mapped
+        self._offsets = self._build_offsets()
+
+    def _build_offsets(self):
+        offsets = array("Q")
+        mm, size, pos = self._mm, len(self._mm), 0
+        while pos < size:
+            end = mm.find(b"\n", pos)
+            if end == -1:
+                end = size
+            line_end = end - 1 if end > pos and mm[end - 1:end] == b"\r" else end
+            if line_end > pos:
+                offsets.append(pos)
+                offsets.append(line_end)
+            pos = end + 1
+        return offsets
+
+    def __len__(self):
+        return len(self._offsets) // 2
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return RecordView(self._mm, self._offsets[2 * index], self._offsets[2 * index + 1])
+
+    def __iter__(self):
+        offsets = self._offsets
+        for i in range(0, len(offsets), 2):
+            yield RecordView(self._mm, offsets[i], offsets[i + 1])
+
+    # Views whose top-level field equals value; lines that do not even contain the
+    # value's bytes are skipped without decoding anything. The needle is encoded the
+    # way json.dumps writes it by default; a non-ASCII value may be written either
+    # raw or \u-escaped, so it has no prefilter.
+    def where(self, field, value):
+        needle = json.dumps(value).encode("ascii") if isinstance(value, str) and value.isascii() else None
+        for view in self:
+            if needle is not None and not view.contains(needle):
+                continue
+            if view.get(field) == value:
+                yield view
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
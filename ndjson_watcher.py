@@ -0,0 +1,193 @@
+import json
+import os
+import threading
+import weakref
+from collections import deque
+
+
+# Tails append-only NDJSON files and hands newly appended records to
+# listeners (shared stores) and subscriptions (one per Streamlit session).
+# Only the bytes appended since the last check are read and decoded.
+# A watched directory tails every *.ndjson file in it, including files
+# created later (e.g. a new monthly segment).
+class NDJSONWatcher:
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self._files = {}  # watched path -> {file path -> {"offset", "partial", "inode"}}
+        self._listeners = {}  # path -> [callback]
+        self._subscriptions = {}  # path -> WeakSet of Subscription
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Start tailing a file or directory. By default only lines appended after this call are reported.
+    def watch(self, path, from_start=False):
+        with self._lock:
+            if path in self._files:
+                return
+            self._files[path] = {}
+            for file_path in self._list_files(path):
+                self._files[path][file_path] = self._new_file_state(file_path, from_start)
+            self._listeners.setdefault(path, [])
+            self._subscriptions.setdefault(path, weakref.WeakSet())
+
+    def _list_files(self, path):
+        if not os.path.isdir(path):
+            return [path]
+        try:
+            names = os.listdir(path)
+        except OSError:
+            return []
+        return [os.path.join(path, n) for n in sorted(names) if n.endswith(".ndjson")]
+
+    def _new_file_state(self, file_path, from_start):
+        offset, inode = 0, None
+        try:
+            stat = os.stat(file_path)
+            inode = stat.st_ino
+            if not from_start:
+                offset = stat.st_size
+        except OSError:
+            pass
+        return {"offset": offset, "partial": b"", "inode": inode}
+
+    # Listeners are called with the list of new records from the watcher thread
+    def add_listener(self, path, callback):
+        self.watch(path)
+        with self._lock:
+            self._listeners[path].append(callback)
+
+    # Sessions subscribe and drain their inbox on rerun. The watcher only keeps a
+    # weak reference, so a subscription goes away together with its session.
+    def subscribe(self, path, predicate=None):
+        self.watch(path)
+        subscription = Subscription(predicate)
+        with self._lock:
+            self._subscriptions[path].add(subscription)
+        return subscription
+
+    # Check every watched file once and dispatch new records; returns how many were read
+    def poll(self):
+        total = 0
+        with self._lock:
+            paths = list(self._files)
+        for path in paths:
+            records = []
+            for file_path in self._refresh_files(path):
+                records.extend(self._read_new(self._files[path][file_path], file_path))
+            if not records:
+                continue
+            total += len(records)
+            with self._lock:
+                listeners = list(self._listeners[path])
+                subscriptions = list(self._subscriptions[path])
+            for callback in listeners:
+                try:
+                    callback(records)
+                except Exception:
+                    continue
+            for subscription in subscriptions:
+                subscription.push(records)
+        return total
+
+    # Pick up files created in a watched directory (read from their start) and drop removed ones
+    def _refresh_files(self, path):
+        files = self._files[path]
+        current = self._list_files(path)
+        if os.path.isdir(path):
+            for file_path in current:
+                if file_path not in files:
+                    files[file_path] = self._new_file_state(file_path, from_start=True)
+            for file_path in list(files):
+                if file_path not in current:
+                    del files[file_path]
+        return current
+
+    def _read_new(self, state, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return []
+
+        # File was replaced or truncated (e.g. rewritten in place): start over
+        if stat.st_ino != state["inode"] or stat.st_size < state["offset"]:
+            state["inode"] = stat.st_ino
+            state["offset"] = 0
+            state["partial"] = b""
+
+        if stat.st_size == state["offset"]:
+            return []
+
+        try:
+            with open(path, "rb") as f:
+                f.seek(state["offset"])
+                chunk = f.read(stat.st_size - state["offset"])
+        except OSError:
+            return []
+        state["offset"] += len(chunk)
+
+        # Keep a trailing line without newline until the writer finishes it
+        lines = (state["partial"] + chunk).split(b"\n")
+        state["partial"] = lines.pop()
+
+        records = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+        return records
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ndjson-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+
+# Per-session inbox of records pushed by the watcher
+class Subscription:
+    def __init__(self, predicate=None):
+        self.predicate = predicate
+        self._inbox = deque()
+        self._skip_ids = set()
+        self._lock = threading.Lock()
+
+    # Don't deliver the record with this id, e.g. one the session wrote itself
+    def skip(self, record_id):
+        with self._lock:
+            self._skip_ids.add(record_id)
+
+    def push(self, records):
+        if self.predicate:
+            records = [r for r in records if self.predicate(r)]
+        if not records:
+            return
+        with self._lock:
+            for record in records:
+                if self._skip_ids and record.get("id") in self._skip_ids:
+                    self._skip_ids.discard(record.get("id"))
+                else:
+                    self._inbox.append(record)
+
+    def pending(self):
+        return len(self._inbox) > 0
+
+    def drain(self):
+        with self._lock:
+            records = list(self._inbox)
+            self._inbox.clear()
+        return records
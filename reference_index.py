@@ -0,0 +1,129 @@
+import os
+import threading
+from collections import OrderedDict
+
+from ndjson_mmap import MappedNDJSON
+
+
+# Stores that references point into. Administrations and observations are never
+# reference targets, and indexing them would re-index a segment on every new dose.
+REFERENCE_STORES = ["fhir_data/practitioner", "fhir_data/patient", "fhir_data/encounter"]
+
+
+# Normalise a FHIR reference ("Practitioner/123", "Practitioner/123/_history/2", a full URL,
+# or a reference dict) to "Type/id"
+def reference_key(reference):
+    if isinstance(reference, dict):
+        reference = reference.get("reference", "")
+    if not reference or "/" not in reference:
+        return None
+    parts = reference.rstrip("/").split("/")
+    if len(parts) >= 4 and parts[-2] == "_history":
+        parts = parts[:-2]
+    if len(parts) < 2:
+        return None
+    resource_type, resource_id = parts[-2:]
+    return f"{resource_type}/{resource_id}"
+
+
+# Global "ResourceType/id" -> (file, line) index over the NDJSON files in stores
+# (files or directories). Indexing only reads resourceType and id from each mapped
+# line; resources are decoded when resolved and kept in an LRU cache.
+class ReferenceIndex:
+    def __init__(self, stores=None, cache_size=1024):
+        self.stores = list(stores or REFERENCE_STORES)
+        self.cache_size = cache_size
+        self._files = {}  # path -> (MappedNDJSON, (size, mtime))
+        self._locations = {}  # "Type/id" -> (path, line)
+        self._keys = {}  # path -> ["Type/id", ...] indexed from that file
+        self._cache = OrderedDict()  # "Type/id" -> resource
+        self._lock = threading.RLock()
+        self.refresh()
+
+    def __len__(self):
+        return len(self._locations)
+
+    def _ndjson_files(self):
+        paths = []
+        for store in self.stores:
+            if os.path.isfile(store):
+                paths.append(store)
+                continue
+            for directory, _, names in os.walk(store):
+                paths.extend(os.path.join(directory, n) for n in sorted(names) if n.endswith(".ndjson"))
+        return paths
+
+    # Re-index files that were added, changed or removed since the last call
+    def refresh(self):
+        with self._lock:
+            current = set()
+            for path in self._ndjson_files():
+                current.add(path)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                version = (stat.st_size, stat.st_mtime_ns)
+                if path in self._files and self._files[path][1] == version:
+                    continue
+                self._index_file(path, version)
+            for path in list(self._files):
+                if path not in current:
+                    self._drop_file(path)
+
+    def _index_file(self, path, version):
+        self._drop_file(path)
+        records = MappedNDJSON(path)
+        self._files[path] = (records, version)
+        keys = self._keys[path] = []
+        for line, view in enumerate(records):
+            resource_type, resource_id = view.get("resourceType"), view.get("id")
+            if resource_type and resource_id:
+                key = f"{resource_type}/{resource_id}"
+                self._locations[key] = (path, line)
+                keys.append(key)
+
+    def _drop_file(self, path):
+        entry = self._files.pop(path, None)
+        if entry is None:
+            return
+        entry[0].close()
+        for key in self._keys.pop(path, []):
+            if self._locations.get(key, (None,))[0] == path:
+                del self._locations[key]
+            self._cache.pop(key, None)
+
+    def location(self, reference):
+        return self._locations.get(reference_key(reference))
+
+    def resolve(self, reference):
+        return self.resolve_many([reference]).get(reference_key(reference))
+
+    # Resolve every reference in one pass: cached resources are returned as-is and
+    # the rest are read file by file in line order. Returns {"Type/id": resource}.
+    def resolve_many(self, references):
+        keys = {k for k in (reference_key(r) for r in references) if k}
+        resolved = {}
+        with self._lock:
+            self.refresh()
+            missing = {}
+            for key in keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    resolved[key] = self._cache[key]
+                elif key in self._locations:
+                    path, line = self._locations[key]
+                    missing.setdefault(path, []).append((line, key))
+
+            for path, lines in missing.items():
+                records = self._files[path][0]
+                for line, key in sorted(lines):
+                    try:
+                        resource = records[line].decode()
+                    except (IndexError, ValueError):
+                        continue
+                    resolved[key] = resource
+                    self._cache[key] = resource
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return resolved
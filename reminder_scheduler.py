@@ -0,0 +1,365 @@
+import argparse
+import heapq
+import itertools
+import json
+import smtplib
+import threading
+from datetime import date, datetime, timedelta
+from email.message import EmailMessage
+
+from admin_segments import SegmentedNDJSON
+from fhir_store import extract_medication, get_administration_med_id, get_subject_patient_id, request_rank
+from ndjson_watcher import NDJSONWatcher
+
+
+patient_file_path = "fhir_data/patient/Patient.ndjson"
+med_admin_dir = "fhir_data/medication_administration"
+med_request_path = "fhir_data/medication_request/MedicationRequest.ndjson"
+
+PERIOD_UNITS = {
+    "s": timedelta(seconds=1),
+    "min": timedelta(minutes=1),
+    "h": timedelta(hours=1),
+    "d": timedelta(days=1),
+    "wk": timedelta(weeks=1),
+    "mo": timedelta(days=30),
+    "a": timedelta(days=365),
+}
+
+
+# Time between doses from a MedicationRequest's timing, or None for as-needed / unscheduled
+def get_dose_interval(request):
+    for dosage in request.get("dosageInstruction", []):
+        if dosage.get("asNeededBoolean"):
+            return None
+        repeat = dosage.get("timing", {}).get("repeat", {})
+        unit = PERIOD_UNITS.get(repeat.get("periodUnit"))
+        if not unit or not repeat.get("frequency") or not repeat.get("period"):
+            continue
+        return unit * repeat["period"] / repeat["frequency"]
+    return None
+
+
+# Parse a FHIR dateTime as a naive local datetime (the app writes naive local times)
+def parse_datetime(value):
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+# Next dose after the last one taken, or the next slot on the prescription's schedule if none was taken
+def next_due_dose(request, interval, last_taken=None, now=None):
+    now = now or datetime.now()
+    if last_taken:
+        return last_taken + interval
+    authored = parse_datetime(request.get("authoredOn")) or now
+    if authored >= now:
+        return authored
+    slots = -(-(now - authored) // interval)  # Round up to the next slot
+    return authored + slots * interval
+
+
+# One pending reminder; __slots__ keeps the per-reminder cost fixed and small
+class DoseReminder:
+    __slots__ = ("due", "patient_id", "med_id", "medication", "dosage", "cancelled")
+
+    def __init__(self, due, patient_id, med_id, medication="", dosage=""):
+        self.due = due
+        self.patient_id = patient_id
+        self.med_id = med_id
+        self.medication = medication
+        self.dosage = dosage
+        self.cancelled = False
+
+
+# Keeps every pending dose reminder in one min-heap ordered by due time.
+# Cancelling marks the heap entry instead of removing it (O(1)); marked entries are
+# dropped when they reach the top, and run_forever compacts the heap when they
+# pile up, so no schedule() or cancel() call pays for a rebuild.
+class ReminderScheduler:
+    def __init__(self, notifier, clock=datetime.now):
+        self.notifier = notifier
+        self.clock = clock
+        self._heap = []  # (due, seq, DoseReminder)
+        self._pending = {}  # (patient id, med id) -> DoseReminder
+        self._schedules = {}  # (patient id, med id) -> (interval, medication, dosage)
+        self._requests = {}  # (patient id, med id) -> {request id: active, scheduled MedicationRequest}
+        self._request_ids = {}  # (patient id, med id) -> id of the MedicationRequest the reminder follows
+        self._last_taken = {}  # (patient id, med id) -> latest administration time seen
+        self._counter = itertools.count()
+        self._cancelled = 0
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def schedule(self, patient_id, med_id, due, medication="", dosage=""):
+        with self._cond:
+            self._cancel_locked((patient_id, med_id))
+            reminder = DoseReminder(due, patient_id, med_id, medication, dosage)
+            self._pending[(patient_id, med_id)] = reminder
+            heapq.heappush(self._heap, (due, next(self._counter), reminder))
+            self._cond.notify()
+        return reminder
+
+    def cancel(self, patient_id, med_id):
+        with self._cond:
+            return self._cancel_locked((patient_id, med_id))
+
+    def _cancel_locked(self, key):
+        reminder = self._pending.pop(key, None)
+        if reminder is None:
+            return False
+        reminder.cancelled = True
+        self._cancelled += 1
+        return True
+
+    # Rebuild the heap without cancelled entries once they make up more than half of it
+    def compact(self):
+        with self._cond:
+            if self._cancelled <= 64 or self._cancelled <= len(self._heap) // 2:
+                return False
+            self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+            heapq.heapify(self._heap)
+            self._cancelled = 0
+            return True
+
+    # Register MedicationRequests and queue the next dose of every (patient, medication)
+    # with an active, scheduled request. Called again with added or rewritten requests,
+    # it reschedules only the keys whose chosen request changed and drops the reminders
+    # of keys with no active request left. When several requests are active for one
+    # key, the one with the highest request_rank is followed, so re-reading the file
+    # keeps the same one. The next dose counts from the latest administration seen.
+    def add_medication_requests(self, requests, last_taken=None):
+        now = self.clock()
+        with self._cond:
+            for key, taken in (last_taken or {}).items():
+                self._note_taken_locked(key, taken)
+            touched = set()
+            for request in requests:
+                if request.get("resourceType") != "MedicationRequest":
+                    continue
+                med = extract_medication(request)
+                key = (get_subject_patient_id(request), med["RXnormCode"] or med["Medication"])
+                candidates = self._requests.setdefault(key, {})
+                if request.get("status") == "active" and get_dose_interval(request) is not None:
+                    candidates[request.get("id")] = request
+                else:
+                    candidates.pop(request.get("id"), None)
+                touched.add(key)
+            for key in touched:
+                candidates = self._requests[key]
+                if not candidates:
+                    del self._requests[key]
+                    self._drop_locked(key)
+                    continue
+                request = max(candidates.values(), key=request_rank)
+                med = extract_medication(request)
+                schedule = (get_dose_interval(request), med["Medication"], med["Dosage"])
+                if self._request_ids.get(key) == request.get("id") and self._schedules.get(key) == schedule:
+                    continue
+                self._schedules[key] = schedule
+                self._request_ids[key] = request.get("id")
+                due = next_due_dose(request, schedule[0], self._last_taken.get(key), now)
+                self.schedule(key[0], key[1], due, med["Medication"], med["Dosage"])
+
+    def _drop_locked(self, key):
+        self._cancel_locked(key)
+        self._schedules.pop(key, None)
+        self._request_ids.pop(key, None)
+
+    def _note_taken_locked(self, key, taken):
+        if key not in self._last_taken or taken > self._last_taken[key]:
+            self._last_taken[key] = taken
+
+    # A recorded administration cancels the pending reminder and queues the following dose
+    def record_administrations(self, administrations):
+        with self._cond:
+            for admin in administrations:
+                if admin.get("resourceType") != "MedicationAdministration":
+                    continue
+                key = (get_subject_patient_id(admin), get_administration_med_id(admin))
+                taken = parse_datetime(admin.get("effectiveDateTime"))
+                if taken is None:
+                    continue
+                self._note_taken_locked(key, taken)
+                if key not in self._schedules:
+                    continue
+                pending = self._pending.get(key)
+                interval, medication, dosage = self._schedules[key]
+                # Ignore administrations older than the dose already being waited for
+                if pending and taken + interval <= pending.due:
+                    continue
+                self.schedule(key[0], key[1], taken + interval, medication, dosage)
+
+    def next_due(self):
+        with self._cond:
+            self._drop_cancelled_locked()
+            return self._heap[0][0] if self._heap else None
+
+    def _drop_cancelled_locked(self):
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)
+            self._cancelled -= 1
+
+    # Fire every reminder due by now; a fired reminder is re-queued for the next slot after now
+    def run_pending(self, now=None):
+        now = now or self.clock()
+        due = []
+        with self._cond:
+            while True:
+                self._drop_cancelled_locked()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                _, _, reminder = heapq.heappop(self._heap)
+                del self._pending[(reminder.patient_id, reminder.med_id)]
+                due.append(reminder)
+        for reminder in due:
+            try:
+                self.notifier.notify(reminder)
+            except Exception as e:
+                print(f"Error sending reminder for {reminder.medication}: {e}")
+            key = (reminder.patient_id, reminder.med_id)
+            with self._cond:
+                if key in self._schedules and key not in self._pending:
+                    interval = self._schedules[key][0]
+                    slots = max(1, (now - reminder.due) // interval + 1)
+                    self.schedule(key[0], key[1], reminder.due + slots * interval, reminder.medication, reminder.dosage)
+        return len(due)
+
+    # Sleep until the next reminder is due (or a new one is scheduled) and fire it
+    def run_forever(self, stop_event, max_sleep=60.0):
+        while not stop_event.is_set():
+            self.run_pending()
+            self.compact()
+            next_due = self.next_due()
+            timeout = max_sleep
+            if next_due is not None:
+                timeout = min(max_sleep, max(0.0, (next_due - self.clock()).total_seconds()))
+            with self._cond:
+                self._cond.wait(timeout)
+
+
+# Sends reminders by email. Without credentials it talks plain SMTP, so it can be
+# pointed at a local stand-in (e.g. `python -m aiosmtpd -n -l localhost:1025`).
+class SMTPNotifier:
+    def __init__(self, recipients, host="localhost", port=25, from_email="reminders@medtracker.com",
+                 username=None, password=None, starttls=False):
+        self.recipients = recipients  # patient id -> email address
+        self.host = host
+        self.port = port
+        self.from_email = from_email
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+
+    def build_message(self, reminder):
+        message = EmailMessage()
+        message["Subject"] = "Medication Reminder"
+        message["From"] = self.from_email
+        message["To"] = self.recipients[reminder.patient_id]
+        message.set_content(
+            f"It is time to take {reminder.medication} ({reminder.dosage}).\n"
+            f"Scheduled for {reminder.due:%Y-%m-%d %H:%M}.\n\n"
+            "- Medication Tracker App\n"
+        )
+        return message
+
+    def notify(self, reminder):
+        if not self.recipients.get(reminder.patient_id):
+            return False
+        with smtplib.SMTP(self.host, self.port) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.send_message(self.build_message(reminder))
+        return True
+
+
+# Prints reminders instead of sending them (for --dry-run)
+class PrintNotifier:
+    def notify(self, reminder):
+        print(f"[{reminder.due:%Y-%m-%d %H:%M}] Patient/{reminder.patient_id}: {reminder.medication} ({reminder.dosage})")
+        return True
+
+
+# Email address of every patient that has one
+def load_patient_emails(path):
+    emails = {}
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    patient = json.loads(line)
+                except ValueError:
+                    continue
+                email = next((t.get("value") for t in patient.get("telecom", []) if t.get("system") == "email"), None)
+                if email:
+                    emails[patient.get("id", "")] = email
+    except OSError:
+        pass
+    return emails
+
+
+# Latest administration time per (patient id, med id) within the lookback window
+def load_last_taken(segments, lookback_days=30):
+    last_taken = {}
+    for admin in segments.read(start=date.today() - timedelta(days=lookback_days)):
+        taken = parse_datetime(admin.get("effectiveDateTime"))
+        if taken is None:
+            continue
+        key = (get_subject_patient_id(admin), get_administration_med_id(admin))
+        if key not in last_taken or taken > last_taken[key]:
+            last_taken[key] = taken
+    return last_taken
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send dose reminders for every patient's active MedicationRequests")
+    parser.add_argument("--smtp-host", default="localhost")
+    parser.add_argument("--smtp-port", type=int, default=1025)
+    parser.add_argument("--smtp-user")
+    parser.add_argument("--smtp-password")
+    parser.add_argument("--starttls", action="store_true")
+    parser.add_argument("--from-email", default="reminders@medtracker.com")
+    parser.add_argument("--dry-run", action="store_true", help="print reminders instead of emailing them")
+    args = parser.parse_args()
+
+    if args.dry_run:
+        notifier = PrintNotifier()
+    else:
+        notifier = SMTPNotifier(load_patient_emails(patient_file_path), args.smtp_host, args.smtp_port,
+                                args.from_email, args.smtp_user, args.smtp_password, args.starttls)
+
+    scheduler = ReminderScheduler(notifier)
+    segments = SegmentedNDJSON(med_admin_dir)
+
+    # Watch first so administrations and prescriptions recorded while loading are not missed
+    watcher = NDJSONWatcher(interval=1.0)
+    watcher.add_listener(med_admin_dir, scheduler.record_administrations)
+    watcher.add_listener(med_request_path, scheduler.add_medication_requests)
+
+    with open(med_request_path, "r") as f:
+        requests = [json.loads(line) for line in f if line.strip()]
+    scheduler.add_medication_requests(requests, load_last_taken(segments))
+    print(f"Scheduled {len(scheduler)} reminders")
+
+    watcher.start()
+    stop_event = threading.Event()
+    try:
+        scheduler.run_forever(stop_event)
+    except KeyboardInterrupt:
+        stop_event.set()
+    finally:
+        watcher.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import glob
+import json
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+repo_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, repo_root)
+
+from ndjson_mmap import MappedNDJSON, RecordView  # noqa: E402
+
+KEYS = ["id", "status", "text", "subject", "x", "a", "b", "effectiveDateTime"]
+STRINGS = ['plain', 'say "hi"', 'back\\slash', '{not [an object', 'a", "id": "fake', 'café', '☃', '']
+
+
+def view(line):
+    return RecordView(line, 0, len(line))
+
+
+# Random JSON value; containers nest up to depth levels, deeper than _NESTED_RE handles
+def random_value(rng, depth):
+    kind = rng.randrange(6 if depth > 0 else 4)
+    if kind == 0:
+        return rng.choice(STRINGS)
+    if kind == 1:
+        return rng.choice([0, -1.5, 12e3, 7])
+    if kind == 2:
+        return rng.choice([True, False, None])
+    if kind == 3:
+        return rng.choice(STRINGS) + str(rng.randrange(100))
+    if kind == 4:
+        return [random_value(rng, depth - 1) for _ in range(rng.randrange(3))]
+    return {rng.choice(KEYS): random_value(rng, depth - 1) for _ in range(rng.randrange(3))}
+
+
+# A value wrapped in depth arrays and objects
+def deep_value(rng, depth):
+    value = random_value(rng, 2)
+    for _ in range(depth):
+        value = [value] if rng.random() < 0.5 else {rng.choice(KEYS): value}
+    return value
+
+
+def random_line(rng):
+    record = {}
+    for key in rng.sample(KEYS, rng.randrange(1, len(KEYS))):
+        record[key] = deep_value(rng, rng.randrange(4, 10)) if rng.random() < 0.3 else random_value(rng, 3)
+    separators = rng.choice([(",", ":"), (", ", ": "), (" , ", " : ")])
+    return json.dumps(record, separators=separators, ensure_ascii=rng.random() < 0.5).encode("utf-8")
+
+
+# RecordView.get must return exactly what json.loads gives for every top-level key
+class RecordViewMatchesJsonTest(unittest.TestCase):
+    # Each key looked up on a fresh view, then all keys in order on one view
+    def assert_matches(self, line):
+        record = json.loads(line)
+        for key in set(KEYS) | set(record):
+            self.assertEqual(view(line).get(key), record.get(key), (key, line))
+        fields = view(line)
+        for key in record:
+            self.assertEqual(fields.get(key), record[key], (key, line))
+
+    def test_value_nested_deeper_than_the_regex(self):
+        line = b'{"text":"say \\"hi\\"","x":[[[[[[[{"a":1,"b":2}]]]]]]],"id":"y"}'
+        self.assertEqual(view(line).get("id"), "y")
+        self.assert_matches(line)
+
+    def test_fuzzed_records(self):
+        rng = random.Random(6440)
+        for _ in range(3000):
+            self.assert_matches(random_line(rng))
+
+    def test_repository_data(self):
+        for path in glob.glob(os.path.join(repo_root, "fhir_data", "**", "*.ndjson"), recursive=True):
+            with open(path, "rb") as f:
+                for line in f:
+                    if line.strip():
+                        self.assert_matches(line.rstrip(b"\r\n"))
+
+
+class WhereTest(unittest.TestCase):
+    def test_finds_escaped_and_raw_non_ascii_values(self):
+        records = [{"id": "José-1"}, {"id": "other"}, {"id": "José-1", "n": 2}, {"id": "plain-1"}]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "records.ndjson")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(json.dumps(records[0]) + "\n")
+                f.write(json.dumps(records[1]) + "\n")
+                f.write(json.dumps(records[2], ensure_ascii=False) + "\n")
+                f.write(json.dumps(records[3]) + "\n")
+            with MappedNDJSON(path) as mapped:
+                self.assertEqual([v.decode() for v in mapped.where("id", "José-1")], [records[0], records[2]])
+                self.assertEqual([v.decode() for v in mapped.where("id", "plain-1")], [records[3]])
+
+
+if __name__ == "__main__":
+    unittest.main()